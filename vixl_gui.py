@@ -1,9 +1,14 @@
+import hashlib
 import sys
+import mmap
 import os
+import stat
 import struct
+import threading
 import zlib
 import zstandard as zstd
-from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton, QFileDialog,
@@ -14,8 +19,131 @@ from PyQt6.QtCore import Qt, QThread, pyqtSignal
 # === VIXL CORE ===
 
 MAGIC = b"VIXL"
-VERSION = 2
+VERSION = 7  # v7: CRC32 of everything after the header stored for verification
 FLAG_COMPRESSED = 0x02  # now zstd
+FLAG_DICT = 0x04  # archive carries a trained zstd dictionary
+HEADER_SIZE = 64
+CHUNK_SIZE = 1 << 20
+
+# per-entry flags
+ENTRY_RAW = 0x01  # stored uncompressed
+
+# store raw when compression saves less than 2%
+RAW_THRESHOLD = 0.98
+
+# formats that are already compressed; recompressing them burns CPU for
+# nothing, so they are sniffed by magic bytes and stored raw up front
+_INCOMPRESSIBLE_MAGICS = (
+    b"\x89PNG",              # png
+    b"\xff\xd8\xff",         # jpeg
+    b"PK\x03\x04",           # zip / jar / office
+    b"\x1f\x8b",             # gzip
+    b"\xfd7zXZ",             # xz
+    b"7z\xbc\xaf",           # 7z
+    b"BZh",                  # bzip2
+    b"\x28\xb5\x2f\xfd",     # zstd
+    b"OggS",                 # ogg
+    b"ID3",                  # mp3
+    b"\x00\x00\x00\x18ftyp", # mp4
+    b"\x00\x00\x00 ftyp",    # mp4
+)
+
+
+# bucket the magics by first byte; most files miss with one dict lookup
+# instead of a startswith per pattern
+_MAGICS_BY_FIRST_BYTE = {}
+for _magic in _INCOMPRESSIBLE_MAGICS:
+    _MAGICS_BY_FIRST_BYTE.setdefault(_magic[0], []).append(_magic)
+
+
+def _looks_incompressible(head):
+    magics = _MAGICS_BY_FIRST_BYTE.get(head[0]) if head else None
+    return magics is not None and any(head.startswith(m) for m in magics)
+
+
+def _relative_paths(paths):
+    # archive paths relative to the inputs' common directory: entries stop
+    # repeating a long absolute prefix, and unpacking lands inside the
+    # chosen output directory instead of the original absolute location
+    try:
+        base = os.path.commonpath([os.path.dirname(p) or "." for p in paths])
+    except ValueError:
+        # mixed drives on Windows; fall back to stripping each anchor
+        base = None
+    rels = []
+    for p in paths:
+        if base is not None:
+            rels.append(os.path.relpath(p, base))
+        else:
+            rels.append(os.path.splitdrive(p)[1].lstrip("\\/"))
+    return rels
+
+
+def _walk_files(root):
+    # iterative scandir walk: DirEntry type checks reuse the stat data the
+    # directory read already fetched, unlike rglob which stats per entry.
+    # symlinked directories are not descended into, but symlinks to files
+    # still count as files, matching what os.walk used to yield
+    stack = [str(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+        except OSError:
+            continue
+
+# precompiled formats; struct.pack/unpack re-parse the format string on
+# every call, which adds up in the per-file loops
+# magic, version, flags, num_files, table_offset, table_size,
+# data_offset, data_size, dict_size, crc32
+_HEADER = struct.Struct("<4sBBHQQQQII16x")
+_PATH_LEN = struct.Struct("<H")
+_ENTRY = struct.Struct("<BQQQ")  # flags, offset, size, comp_size
+
+# zstd's default level; several times faster than level 9 for a small
+# ratio cost, and decoding is unaffected
+ZSTD_LEVEL = 3
+
+# dictionary training pays off on corpora of many small, similar files
+DICT_SIZE = 128 * 1024
+DICT_MIN_FILES = 16
+DICT_SAMPLE_FILES = 100
+DICT_SAMPLE_LIMIT = 1 << 20
+
+
+def _bounded_map(pool, fn, items, window):
+    # like pool.map, but keeps at most `window` jobs in flight so results
+    # can't pile up in memory faster than the consumer drains them
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _train_dictionary(input_paths):
+    if len(input_paths) < DICT_MIN_FILES:
+        return None
+    samples = []
+    for path_str in input_paths[:DICT_SAMPLE_FILES]:
+        try:
+            if os.path.getsize(path_str) <= DICT_SAMPLE_LIMIT:
+                with open(path_str, "rb") as sample:
+                    samples.append(sample.read())
+        except OSError:
+            continue
+    if len(samples) < DICT_MIN_FILES:
+        return None
+    try:
+        return zstd.train_dictionary(DICT_SIZE, samples)
+    except zstd.ZstdError:
+        return None
 
 class VixlPacker(QThread):
     progress = pyqtSignal(int)
@@ -28,72 +156,301 @@ class VixlPacker(QThread):
         self.input_paths = input_paths
 
     def run(self):
+        archive_started = False
         try:
-            file_table = b""
-            file_data = b""
+            # expand folders here, off the GUI thread, so dropping a huge
+            # tree doesn't freeze the window while it is enumerated
+            input_paths = []
+            for entry in self.input_paths:
+                if os.path.isdir(entry):
+                    input_paths.extend(_walk_files(entry))
+                else:
+                    input_paths.append(entry)
+
+            table_parts = []
             offset = 0
 
-            total_files = len(self.input_paths)
+            total_files = len(input_paths)
             if total_files == 0:
                 self.error.emit("No files to pack.")
                 return
 
-            cctx = zstd.ZstdCompressor(level=9)
-
-            for i, path_str in enumerate(self.input_paths):
-                file = Path(path_str)
-                data = file.read_bytes()
-                comp = cctx.compress(data)
-                rel_path = str(file).encode("utf-8")
-                file_table += struct.pack("<H", len(rel_path))
-                file_table += rel_path
-                file_table += struct.pack("<QQQ", offset, len(data), len(comp))
-                file_data += comp
-                offset += len(comp)
-
-                self.progress.emit(int((i + 1) / total_files * 100))
-
-            header = MAGIC
-            header += struct.pack("B", VERSION)
-            header += struct.pack("B", FLAG_COMPRESSED)
-            header += struct.pack("<H", total_files)
-            header += b"\x00" * 24
-
-            with open(self.archive_path, "wb") as f:
-                f.write(header + file_table + file_data)
+            dict_data = _train_dictionary(input_paths)
+            flags = FLAG_COMPRESSED | (FLAG_DICT if dict_data else 0)
+
+            # one compressor per worker thread; zstd releases the GIL while
+            # compressing, so files compress in parallel across cores
+            local = threading.local()
+
+            def compress_file(path_str):
+                cctx = getattr(local, "cctx", None)
+                if cctx is None:
+                    cctx = local.cctx = zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data)
+                    # one read buffer per worker, reused across files, so the
+                    # chunk loop stops allocating a fresh bytes per read
+                    local.buf = memoryview(bytearray(CHUNK_SIZE))
+                buf = local.buf
+                size = os.path.getsize(path_str)
+                # hash while reading so identical files can share one blob
+                hasher = hashlib.blake2b(digest_size=16)
+                with open(path_str, "rb", buffering=0) as src:
+                    if _looks_incompressible(src.read(16)):
+                        src.seek(0)
+                        while n := src.readinto(buf):
+                            hasher.update(buf[:n])
+                        return size, None, ENTRY_RAW, hasher.digest()
+                    src.seek(0)
+                    if size <= len(buf):
+                        # small file: one read, one one-shot compress call
+                        n = 0
+                        while m := src.readinto(buf[n:]):
+                            n += m
+                        size = n
+                        hasher.update(buf[:n])
+                        comp = cctx.compress(buf[:n])
+                    else:
+                        # large file: map it and let the kernel page data in
+                        # on demand; hashing and zstd read the mapping with no
+                        # userspace copy, and only the compressed result is
+                        # ever held in full
+                        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            hasher.update(mm)
+                            comp = cctx.compress(mm)
+                if size and len(comp) >= size * RAW_THRESHOLD:
+                    # compression didn't pay (already-compressed input); store raw
+                    return size, None, ENTRY_RAW, hasher.digest()
+                return size, comp, 0, hasher.digest()
+
+            # a wide write buffer batches the many small frame writes into
+            # 1 MiB syscalls
+            archive_started = True
+            with open(self.archive_path, "wb", buffering=CHUNK_SIZE) as f:
+                # placeholder header, patched once the table offset is known
+                f.write(b"\x00" * HEADER_SIZE)
+                dict_bytes = dict_data.as_bytes() if dict_data else b""
+                f.write(dict_bytes)
+                # running CRC32 of everything after the header; zlib's CRC is
+                # hardware-accelerated and effectively free next to the writes
+                crc = zlib.crc32(dict_bytes)
+
+                # content digest -> (entry_flags, offset, size, comp_size);
+                # duplicate files get a table entry pointing at the same blob
+                seen = {}
+                last_pct = -1
+                rel_paths = _relative_paths(input_paths)
+
+                workers = os.cpu_count() or 1
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    # results come back in input order, so offsets stay
+                    # deterministic; the bounded window keeps the readers and
+                    # compressors just ahead of the writer
+                    results = _bounded_map(pool, compress_file, input_paths,
+                                           workers * 2)
+                    for i, (path_str, (size, comp, entry_flags, digest)) in enumerate(zip(input_paths, results)):
+                        dup = seen.get(digest)
+                        if dup is not None:
+                            entry_flags, entry_offset, size, comp_size = dup
+                        else:
+                            entry_offset = offset
+                            if comp is None:
+                                # raw entry: stream the original bytes straight in
+                                with open(path_str, "rb") as src:
+                                    while chunk := src.read(CHUNK_SIZE):
+                                        crc = zlib.crc32(chunk, crc)
+                                        f.write(chunk)
+                                comp_size = size
+                            else:
+                                crc = zlib.crc32(comp, crc)
+                                f.write(comp)
+                                comp_size = len(comp)
+                            offset += comp_size
+                            seen[digest] = (entry_flags, entry_offset, size, comp_size)
+                        rel_path = rel_paths[i].encode("utf-8")
+                        # one pack call and one bytes object per entry
+                        table_parts.append(struct.pack(
+                            f"<H{len(rel_path)}sBQQQ", len(rel_path), rel_path,
+                            entry_flags, entry_offset, size, comp_size))
+
+                        # each emit crosses the thread boundary through Qt's
+                        # queued signals; only bother when the percent moves
+                        pct = (i + 1) * 100 // total_files
+                        if pct != last_pct:
+                            self.progress.emit(pct)
+                            last_pct = pct
+
+                table_offset = f.tell()
+                file_table = b"".join(table_parts)
+                crc = zlib.crc32(file_table, crc)
+                f.write(file_table)
+                f.flush()
+
+                # patch the header with one positioned write where the
+                # platform has pwrite (everything just got flushed, so the
+                # seek-back on the buffered stream is a harmless fallback)
+                data_offset = HEADER_SIZE + len(dict_bytes)
+                header = _HEADER.pack(MAGIC, VERSION, flags, total_files,
+                                      table_offset, len(file_table),
+                                      data_offset, table_offset - data_offset,
+                                      len(dict_bytes), crc)
+                if hasattr(os, "pwrite"):
+                    os.pwrite(f.fileno(), header, 0)
+                else:
+                    f.seek(0)
+                    f.write(header)
 
             self.finished.emit(self.archive_path)
         except Exception as e:
+            # don't strand a half-written archive with a zeroed header;
+            # only touch the path once we actually started writing it
+            if archive_started:
+                try:
+                    os.unlink(self.archive_path)
+                except OSError:
+                    pass
             self.error.emit(str(e))
 
 
 def unpack_vixl(archive_path, output_dir):
     with open(archive_path, "rb") as f:
-        if f.read(4) != MAGIC:
+        header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or not header.startswith(MAGIC):
             raise ValueError("not a valid .vixl archive")
-
-        version = f.read(1)
-        flags = f.read(1)
-        num_files = struct.unpack("<H", f.read(2))[0]
-        f.read(24)
-
+        (magic, version, flags, num_files, table_offset, table_size,
+         data_offset, data_size, dict_size, crc) = _HEADER.unpack(header)
+
+        if version != VERSION:
+            raise ValueError(f"unsupported .vixl archive version {version}")
+
+        # sanity-check the header geometry against the real file size so a
+        # crafted or damaged table offset fails here, not mid-parse
+        file_size = os.fstat(f.fileno()).st_size
+        if (HEADER_SIZE + dict_size > data_offset
+                or data_offset + data_size > table_offset
+                or table_offset + table_size > file_size):
+            raise ValueError("not a valid .vixl archive (header out of bounds)")
+
+        # everything after the header is consumed front to back; tell the
+        # kernel so readahead works in our favor
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), data_offset, data_size,
+                             os.POSIX_FADV_SEQUENTIAL)
+
+        # map the archive once: the table parse and every decompress work
+        # straight off the page cache with no intermediate copies
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+
+        # verify before touching the output directory
+        if zlib.crc32(view[HEADER_SIZE:]) != crc:
+            view.release()
+            mm.close()
+            raise ValueError("archive is corrupt (CRC mismatch)")
+
+        dict_data = None
+        if flags & FLAG_DICT:
+            dict_data = zstd.ZstdCompressionDict(
+                bytes(view[HEADER_SIZE:HEADER_SIZE + dict_size]))
+
+        # the table runs to the end of the file; walk it in memory rather
+        # than three reads per entry, refusing to step past its extent
+        # (num_files could claim more entries than the table holds)
+        table_end = table_offset + table_size
+        out_root = os.path.abspath(output_dir)
         files = []
-        for _ in range(num_files):
-            path_len = struct.unpack("<H", f.read(2))[0]
-            path = f.read(path_len).decode()
-            offset, size, comp_size = struct.unpack("<QQQ", f.read(12))
-            files.append((path, offset, size, comp_size))
-
-        base = f.tell()
-        dctx = zstd.ZstdDecompressor()
-
-        for path, offset, size, comp_size in files:
-            f.seek(base + offset)
-            comp_data = f.read(comp_size)
-            raw = dctx.decompress(comp_data)
-            out_path = Path(output_dir) / path
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            out_path.write_bytes(raw)
+        pos = table_offset
+        try:
+            for _ in range(num_files):
+                if pos + _PATH_LEN.size > table_end:
+                    raise ValueError("not a valid .vixl archive (file table truncated)")
+                path_len = _PATH_LEN.unpack_from(view, pos)[0]
+                pos += 2
+                if pos + path_len + _ENTRY.size > table_end:
+                    raise ValueError("not a valid .vixl archive (file table truncated)")
+                path = bytes(view[pos:pos + path_len]).decode()
+                pos += path_len
+                entry_flags, offset, size, comp_size = _ENTRY.unpack_from(view, pos)
+                pos += _ENTRY.size
+                # refuse entries that escape the output directory (absolute
+                # paths or ".." components from a crafted archive)
+                out_path = os.path.normpath(os.path.join(out_root, path))
+                try:
+                    contained = os.path.commonpath([out_root, out_path]) == out_root
+                except ValueError:
+                    contained = False
+                if not contained:
+                    raise ValueError(f"unsafe path in archive: {path}")
+                files.append((out_path, entry_flags, offset, size, comp_size))
+        except ValueError:
+            view.release()
+            mm.close()
+            raise
+
+        # extract in offset order so reads sweep the archive forward
+        files.sort(key=lambda entry: entry[2])
+
+        data_base = data_offset
+        fd = f.fileno()
+        local = threading.local()
+
+        # most entries share a parent directory; remember what already
+        # exists instead of paying a mkdir syscall chain per file
+        made_dirs = set()
+        dirs_lock = threading.Lock()
+
+        def ensure_dir(parent):
+            with dirs_lock:
+                if parent in made_dirs:
+                    return
+                os.makedirs(parent, exist_ok=True)
+                p = parent
+                while p and p not in made_dirs:
+                    made_dirs.add(p)
+                    p = os.path.dirname(p)
+
+        def write_raw(out_path, offset, size):
+            # raw entry: let the kernel copy archive bytes straight to the
+            # output file, without crossing into Python at all
+            with open(out_path, "wb") as out_f:
+                if size and hasattr(os, "copy_file_range"):
+                    try:
+                        copied = 0
+                        while copied < size:
+                            n = os.copy_file_range(fd, out_f.fileno(), size - copied,
+                                                   offset_src=data_base + offset + copied)
+                            if n == 0:
+                                raise OSError
+                            copied += n
+                        return
+                    except OSError:
+                        out_f.seek(0)
+                        out_f.truncate()
+                out_f.write(view[data_base + offset:data_base + offset + size])
+
+        def extract(entry):
+            # paths were resolved and containment-checked during the table walk
+            out_path, entry_flags, offset, size, comp_size = entry
+            ensure_dir(os.path.dirname(out_path))
+            if entry_flags & ENTRY_RAW:
+                write_raw(out_path, offset, size)
+                return
+            dctx = getattr(local, "dctx", None)
+            if dctx is None:
+                dctx = local.dctx = zstd.ZstdDecompressor(dict_data=dict_data)
+            # a memoryview slice hands the mapped pages to zstd without a copy;
+            # the table's size field sizes the output buffer in one allocation
+            # even for frames that don't embed their content size
+            raw = dctx.decompress(view[data_base + offset:data_base + offset + comp_size],
+                                  max_output_size=size)
+            with open(out_path, "wb") as out_f:
+                out_f.write(raw)
+
+        try:
+            # decompression and file writes both release the GIL
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                list(pool.map(extract, files))
+        finally:
+            view.release()
+            mm.close()
 
 # === GUI ===
 
@@ -129,7 +486,8 @@ class VixlWindow(QWidget):
         self.unpack_button.clicked.connect(self.unpack_archive)
         self.layout.addWidget(self.unpack_button)
 
-        self.files = []
+        # dict as ordered set: O(1) duplicate checks, keeps insertion order
+        self.files = {}
 
     def add_files(self):
         files, _ = QFileDialog.getOpenFileNames(self, "Select Files")
@@ -138,7 +496,7 @@ class VixlWindow(QWidget):
 
     def _add_file(self, file):
         if file not in self.files:
-            self.files.append(file)
+            self.files[file] = None
             self.file_list.addItem(file)
 
     def dragEnterEvent(self, event):
@@ -146,14 +504,29 @@ class VixlWindow(QWidget):
             event.acceptProposedAction()
 
     def dropEvent(self, event):
+        new_files = []
+
+        def collect(file):
+            if file not in self.files:
+                self.files[file] = None
+                new_files.append(file)
+
         for url in event.mimeData().urls():
             path = url.toLocalFile()
-            if os.path.isfile(path):
-                self._add_file(path)
-            elif os.path.isdir(path):
-                for root, _, files in os.walk(path):
-                    for file in files:
-                        self._add_file(os.path.join(root, file))
+            # one stat per dropped item; isfile + isdir would do two
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                collect(path)
+            elif stat.S_ISDIR(st.st_mode):
+                for file in _walk_files(path):
+                    collect(file)
+
+        # one addItems call; per-item addItem makes Qt re-layout every insert
+        if new_files:
+            self.file_list.addItems(new_files)
 
     def pack_archive(self):
         if not self.files:
@@ -165,18 +538,8 @@ class VixlWindow(QWidget):
             self.progress.setValue(0)
             self.pack_button.setEnabled(False)
 
-            # flatten all files/folders first
-            file_entries = []
-            for entry in self.files:
-                p = Path(entry)
-                if p.is_dir():
-                    for f in p.rglob("*"):
-                        if f.is_file():
-                            file_entries.append(str(f))
-                else:
-                    file_entries.append(str(p))
-
-            self.thread = VixlPacker(save_path, file_entries)
+            # the packer expands folders on its own thread
+            self.thread = VixlPacker(save_path, list(self.files))
 
             self.thread.progress.connect(self.progress.setValue)
             self.thread.finished.connect(self.on_pack_done)